@@ -1,130 +1,230 @@
 from tinytroupe import TaskExecutor, Analyst, TroupeDirector, Task
-from typing import List, Dict
+from typing import Coroutine, List, Dict, Tuple
 import asyncio
+import functools
+import json
+import logging
+import uuid
+import weakref
+
+logger = logging.getLogger(__name__)
+
+class BackgroundRegistry:
+    """Runs fire-and-forget coroutines, at most one per key at a time"""
+    __slots__ = ("_tasks",)
 
-class DentalCareTeam:
     def __init__(self):
+        # Running tasks by key; holding them keeps them from being garbage
+        # collected, and each is dropped as soon as it finishes
+        self._tasks = {}
+
+    def register(self, key: str, coro: Coroutine) -> Tuple[asyncio.Task, bool]:
+        """Start a coroutine in the background unless one is running under key; return the task and whether it's new"""
+        if key in self._tasks:
+            coro.close()
+            return self._tasks[key], False
+
+        task = asyncio.create_task(coro)
+        self._tasks[key] = task
+        task.add_done_callback(lambda done: self._finished(key, done))
+        return task, True
+
+    def _finished(self, key: str, task: asyncio.Task):
+        """Evict a finished task and log its failure, if any"""
+        self._tasks.pop(key, None)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Background task %s failed", key, exc_info=task.exception())
+
+class DentalCareTeam:
+    __slots__ = (
+        "director",
+        "team",
+        "general_dentist",
+        "dental_hygienist",
+        "treatment_coordinator",
+        "dental_specialist",
+        "patient_care_coordinator",
+        "_state_store",
+        "_state_ttl",
+        "_max_concurrent_specialists",
+        "_loop_resources"
+    )
+
+    # Fixed fields for each kind of task, shared by every task created
+    _EXAM_TEMPLATE = {
+        "name": "Initial Examination",
+        "description": "Complete dental examination and treatment planning",
+        "required_expertise": frozenset({"general_dentistry", "diagnosis"})
+    }
+
+    _HYGIENE_TEMPLATE = {
+        "name": "Dental Hygiene",
+        "description": "Provide dental cleaning and preventive care",
+        "required_expertise": frozenset({"cleaning", "preventive_care"})
+    }
+
+    _COORDINATION_TEMPLATE = {
+        "name": "Treatment Coordination",
+        "description": "Coordinate treatment schedule and insurance coverage",
+        "required_expertise": frozenset({"treatment_planning", "insurance_coordination"})
+    }
+
+    _SPECIALIST_TEMPLATE = {
+        "name": "Specialist Consultation",
+        "description": "Provide specialized dental treatment",
+        "required_expertise": frozenset({"endodontics", "orthodontics", "oral_surgery"})
+    }
+
+    _CARE_TEMPLATE = {
+        "name": "Patient Care Management",
+        "description": "Ensure patient comfort and treatment follow-up",
+        "required_expertise": frozenset({"patient_communication", "care_planning"})
+    }
+
+    def __init__(self, max_concurrent_specialists: int = 8, state_store=None, state_ttl: int = 7 * 24 * 3600):
         self.director = TroupeDirector()
+
+        # Optional Redis-style hash store (hset/hgetall/expire) that records
+        # each completed workflow stage so an interrupted workflow can resume,
+        # possibly on another worker; saved state expires after state_ttl
+        # seconds
+        self._state_store = state_store
+        self._state_ttl = state_ttl
+
+        # In-flight limit for specialist consultations, so many referrals
+        # can't flood the loop
+        self._max_concurrent_specialists = max_concurrent_specialists
+
+        # The specialist semaphore and background tasks are bound to the
+        # event loop that uses them, while the team itself may be shared
+        # across loops (see get_dental_team), so they are kept per loop
+        self._loop_resources = weakref.WeakKeyDictionary()
         
         # Define specialized dental care roles
         self.team = {
             "general_dentist": TaskExecutor(
                 name="General Dentist",
-                expertise=["general_dentistry", "diagnosis", "treatment_planning"],
+                expertise=frozenset({"general_dentistry", "diagnosis", "treatment_planning"}),
                 description="Provides primary dental care and coordinates treatments"
             ),
             
             "dental_hygienist": TaskExecutor(
                 name="Dental Hygienist",
-                expertise=["cleaning", "preventive_care", "patient_education"],
+                expertise=frozenset({"cleaning", "preventive_care", "patient_education"}),
                 description="Performs cleanings and preventive care"
             ),
             
             "treatment_coordinator": TaskExecutor(
                 name="Treatment Coordinator",
-                expertise=["treatment_planning", "scheduling", "insurance_coordination"],
+                expertise=frozenset({"treatment_planning", "scheduling", "insurance_coordination"}),
                 description="Manages treatment plans and scheduling"
             ),
             
             "dental_specialist": TaskExecutor(
                 name="Dental Specialist",
-                expertise=["endodontics", "orthodontics", "oral_surgery"],
+                expertise=frozenset({"endodontics", "orthodontics", "oral_surgery"}),
                 description="Provides specialized dental treatments"
             ),
             
             "patient_care_coordinator": TaskExecutor(
                 name="Patient Care Coordinator",
-                expertise=["patient_communication", "care_planning", "follow_up"],
+                expertise=frozenset({"patient_communication", "care_planning", "follow_up"}),
                 description="Ensures patient comfort and treatment adherence"
             )
         }
+
+        # Bind members directly so dispatch doesn't go through the dict
+        (
+            self.general_dentist,
+            self.dental_hygienist,
+            self.treatment_coordinator,
+            self.dental_specialist,
+            self.patient_care_coordinator
+        ) = (self.team[role] for role in (
+            "general_dentist",
+            "dental_hygienist",
+            "treatment_coordinator",
+            "dental_specialist",
+            "patient_care_coordinator"
+        ))
         
         # Register team members
         for role, member in self.team.items():
             self.director.register_agent(member)
 
-    async def initial_examination(self, patient_data: Dict) -> Task:
+    def _resources(self) -> Tuple[asyncio.Semaphore, BackgroundRegistry]:
+        """Return the specialist semaphore and background registry for the running loop"""
+        loop = asyncio.get_running_loop()
+        if loop not in self._loop_resources:
+            self._loop_resources[loop] = (
+                asyncio.Semaphore(self._max_concurrent_specialists),
+                BackgroundRegistry()
+            )
+        return self._loop_resources[loop]
+
+    def initial_examination(self, patient_data: Dict) -> Tuple[Task, Coroutine]:
         """Perform initial dental examination and create treatment plan"""
-        exam_task = Task(
-            name="Initial Examination",
-            description="Complete dental examination and treatment planning",
-            required_expertise=["general_dentistry", "diagnosis"],
-            parameters={
-                "patient_data": patient_data,
-                "examination_type": "comprehensive"
-            }
-        )
+        exam_task = Task(**self._EXAM_TEMPLATE, parameters={
+            "patient_data": patient_data,
+            "examination_type": "comprehensive"
+        })
         
-        await self.director.assign_task(
+        dispatch = self.director.assign_task(
             task=exam_task,
-            executor=self.team["general_dentist"]
+            executor=self.general_dentist
         )
-        return exam_task
+        return exam_task, dispatch
 
-    async def schedule_hygiene_care(self, patient_id: str, care_type: str) -> Task:
+    def schedule_hygiene_care(self, patient_id: str, care_type: str) -> Tuple[Task, Coroutine]:
         """Schedule and perform dental hygiene services"""
-        hygiene_task = Task(
-            name="Dental Hygiene",
-            description="Provide dental cleaning and preventive care",
-            required_expertise=["cleaning", "preventive_care"],
-            parameters={
-                "patient_id": patient_id,
-                "care_type": care_type
-            }
-        )
+        hygiene_task = Task(**self._HYGIENE_TEMPLATE, parameters={
+            "patient_id": patient_id,
+            "care_type": care_type
+        })
         
-        await self.director.assign_task(
+        dispatch = self.director.assign_task(
             task=hygiene_task,
-            executor=self.team["dental_hygienist"]
+            executor=self.dental_hygienist
         )
-        return hygiene_task
+        return hygiene_task, dispatch
 
-    async def coordinate_treatment(self, treatment_plan: Dict) -> Task:
+    def coordinate_treatment(self, treatment_plan: Dict) -> Tuple[Task, Coroutine]:
         """Coordinate treatment schedule and insurance"""
-        coordination_task = Task(
-            name="Treatment Coordination",
-            description="Coordinate treatment schedule and insurance coverage",
-            required_expertise=["treatment_planning", "insurance_coordination"],
-            parameters=treatment_plan
-        )
+        coordination_task = Task(**self._COORDINATION_TEMPLATE, parameters=treatment_plan)
         
-        await self.director.assign_task(
+        dispatch = self.director.assign_task(
             task=coordination_task,
-            executor=self.team["treatment_coordinator"]
+            executor=self.treatment_coordinator
         )
-        return coordination_task
+        return coordination_task, dispatch
 
-    async def specialist_consultation(self, case_details: Dict) -> Task:
+    def specialist_consultation(self, case_details: Dict) -> Tuple[Task, Coroutine]:
         """Arrange specialist consultation and treatment"""
-        specialist_task = Task(
-            name="Specialist Consultation",
-            description="Provide specialized dental treatment",
-            required_expertise=["endodontics", "orthodontics", "oral_surgery"],
-            parameters=case_details
-        )
+        specialist_task = Task(**self._SPECIALIST_TEMPLATE, parameters=case_details)
         
-        await self.director.assign_task(
-            task=specialist_task,
-            executor=self.team["dental_specialist"]
-        )
-        return specialist_task
+        dispatch = self._dispatch_specialist(specialist_task)
+        return specialist_task, dispatch
+
+    async def _dispatch_specialist(self, task: Task):
+        """Dispatch a specialist task once a consultation slot is free"""
+        specialist_sem, _ = self._resources()
+        async with specialist_sem:
+            await self.director.assign_task(
+                task=task,
+                executor=self.dental_specialist
+            )
 
-    async def manage_patient_care(self, patient_info: Dict) -> Task:
+    def manage_patient_care(self, patient_info: Dict) -> Tuple[Task, Coroutine]:
         """Manage ongoing patient care and communication"""
-        care_task = Task(
-            name="Patient Care Management",
-            description="Ensure patient comfort and treatment follow-up",
-            required_expertise=["patient_communication", "care_planning"],
-            parameters=patient_info
-        )
+        care_task = Task(**self._CARE_TEMPLATE, parameters=patient_info)
         
-        await self.director.assign_task(
+        dispatch = self.director.assign_task(
             task=care_task,
-            executor=self.team["patient_care_coordinator"]
+            executor=self.patient_care_coordinator
         )
-        return care_task
+        return care_task, dispatch
 
-    async def create_treatment_plan(self, examination_results: Dict) -> Dict:
+    def create_treatment_plan(self, examination_results: Dict) -> Dict:
         """Create comprehensive treatment plan"""
         return {
             "preventive_care": {
@@ -138,55 +238,169 @@ class DentalCareTeam:
             "priority_procedures": examination_results.get("priority_treatments", [])
         }
 
-    async def run_dental_care_workflow(self, patient_data: Dict):
-        """Execute complete dental care workflow"""
-        try:
-            # Initial examination
-            exam_task = await self.initial_examination(patient_data)
-            exam_results = await exam_task.complete()
+    async def _load_state(self, workflow_id: str) -> Dict:
+        """Load the stages already completed for a workflow"""
+        if self._state_store is None:
+            return {}
 
-            # Create treatment plan
-            treatment_plan = await self.create_treatment_plan(exam_results)
+        # The store client is synchronous, so keep its I/O off the loop
+        stored = await asyncio.to_thread(self._state_store.hgetall, f"workflow:{workflow_id}")
+        return {
+            (field.decode() if isinstance(field, bytes) else field): json.loads(value)
+            for field, value in stored.items()
+        }
+
+    async def _save_state(self, workflow_id: str, stages: Dict):
+        """Record completed stages for a workflow"""
+        if self._state_store is None:
+            return
+
+        # Serialize before touching the store so unserializable results fail
+        # here rather than being saved in a form a resume can't use
+        mapping = {stage: json.dumps(value) for stage, value in stages.items()}
+        key = f"workflow:{workflow_id}"
+
+        def save():
+            self._state_store.hset(key, mapping=mapping)
+            self._state_store.expire(key, self._state_ttl)
+
+        await asyncio.to_thread(save)
+
+    async def _dispatch_treatment(self, patient_data: Dict, treatment_plan: Dict) -> Dict:
+        """Dispatch and complete all tasks that follow the treatment plan"""
+        # Dispatch coordination, specialist consultations and (if needed)
+        # immediate hygiene care together; a failure in any of them cancels
+        # the rest
+        async with asyncio.TaskGroup() as group:
+            coordination_task, dispatch = self.coordinate_treatment(treatment_plan)
+            group.create_task(dispatch)
+
+            specialist_tasks = []
+            for referral in treatment_plan["specialist_referrals"]:
+                specialist_task, dispatch = self.specialist_consultation(referral)
+                specialist_tasks.append(specialist_task)
+                group.create_task(dispatch)
 
-            # Schedule immediate hygiene care if needed
             if treatment_plan["preventive_care"].get("immediate_cleaning"):
-                hygiene_task = await self.schedule_hygiene_care(
+                hygiene_task, dispatch = self.schedule_hygiene_care(
                     patient_data["id"],
                     "comprehensive_cleaning"
                 )
+                group.create_task(dispatch)
 
-            # Coordinate overall treatment
-            coordination_task = await self.coordinate_treatment(treatment_plan)
+        # Wait for all tasks to complete; without referrals only the
+        # coordination task is left, so skip the group
+        if specialist_tasks:
+            async with asyncio.TaskGroup() as group:
+                group.create_task(coordination_task.complete())
+                for task in specialist_tasks:
+                    group.create_task(task.complete())
+        else:
+            await coordination_task.complete()
 
-            # Setup specialist consultations if needed
-            specialist_tasks = []
-            for referral in treatment_plan["specialist_referrals"]:
-                specialist_task = await self.specialist_consultation(referral)
-                specialist_tasks.append(specialist_task)
+        return {
+            "coordination_status": coordination_task.results,
+            "specialist_consultations": [task.results for task in specialist_tasks]
+        }
+
+    async def _follow_up_patient_care(self, workflow_id: str, patient_data: Dict):
+        """Dispatch and complete patient care management, recording its status"""
+        care_task, dispatch = self.manage_patient_care(patient_data)
+        await dispatch
+        await care_task.complete()
+
+        await self._save_state(workflow_id, {"patient_care_status": care_task.results})
+        return care_task.results
 
-            # Ongoing patient care management
-            care_task = await self.manage_patient_care(patient_data)
+    async def gather_results(self, handle: asyncio.Task):
+        """Wait for background patient care started by the workflow and return its status"""
+        return await handle
 
-            # Wait for all tasks to complete
-            tasks = [coordination_task, care_task] + specialist_tasks
-            await asyncio.gather(*tasks)
+    async def run_dental_care_workflow(self, patient_data: Dict, workflow_id: str = None):
+        """Execute complete dental care workflow"""
+        # A new run gets a fresh id. The id is returned whether the run
+        # succeeds or fails, and passing it back resumes the run, skipping
+        # the stages it recorded
+        workflow_id = workflow_id or uuid.uuid4().hex
+        care_handle = None
+        care_started = False
+        try:
+            state = await self._load_state(workflow_id)
+
+            # Initial examination
+            if "examination" in state:
+                exam_results = state["examination"]
+            else:
+                exam_task, exam_dispatch = self.initial_examination(patient_data)
+                await exam_dispatch
+                exam_results = await exam_task.complete()
+                await self._save_state(workflow_id, {"examination": exam_results})
+
+            # Create treatment plan
+            if "treatment_plan" in state:
+                treatment_plan = state["treatment_plan"]
+            else:
+                treatment_plan = self.create_treatment_plan(exam_results)
+                await self._save_state(workflow_id, {"treatment_plan": treatment_plan})
+
+            # Ongoing patient care doesn't gate the response; it runs in the
+            # background and its status is collected with gather_results.
+            # Registering under the workflow id means a resume while care is
+            # still running reuses that task instead of dispatching again
+            if "patient_care_status" in state:
+                care_status = state["patient_care_status"]
+            else:
+                care_status = "pending"
+                _, background = self._resources()
+                care_handle, care_started = background.register(
+                    workflow_id,
+                    self._follow_up_patient_care(workflow_id, patient_data)
+                )
+
+            # Coordination and specialist results are saved in a single
+            # write, so one field tells whether the stage completed
+            if "coordination_status" in state:
+                treatment_status = {
+                    stage: state[stage] for stage in (
+                        "coordination_status",
+                        "specialist_consultations"
+                    )
+                }
+            else:
+                treatment_status = await self._dispatch_treatment(patient_data, treatment_plan)
+                await self._save_state(workflow_id, treatment_status)
 
             return {
+                "workflow_id": workflow_id,
                 "examination": exam_results,
                 "treatment_plan": treatment_plan,
-                "coordination_status": coordination_task.results,
-                "specialist_consultations": [task.results for task in specialist_tasks],
-                "patient_care_status": care_task.results
+                **treatment_status,
+                "patient_care_status": care_status,
+                "patient_care_handle": care_handle
             }
 
         except Exception as e:
-            print(f"Error in dental care workflow: {str(e)}")
-            return None
+            # The caller gets no handle on failure, so don't leave care running;
+            # care reused from an earlier call still belongs to that call
+            if care_started:
+                care_handle.cancel()
+
+            errors = e.exceptions if isinstance(e, ExceptionGroup) else [e]
+            for error in errors:
+                logger.error("Error in dental care workflow %s: %s", workflow_id, error, exc_info=error)
+            return {"workflow_id": workflow_id, "error": str(e)}
+
+@functools.lru_cache(maxsize=1)
+def get_dental_team() -> DentalCareTeam:
+    """Return the shared dental care team, building it on first use"""
+    # Only the director and its agents are shared; per-workflow state lives
+    # in run_dental_care_workflow and loop-bound objects are kept per loop
+    return DentalCareTeam()
 
 # Example usage
 async def main():
-    # Create dental care team
-    dental_team = DentalCareTeam()
+    # Get dental care team
+    dental_team = get_dental_team()
     
     # Example patient data
     patient_data = {
@@ -208,11 +422,15 @@ async def main():
     # Run dental care workflow
     results = await dental_team.run_dental_care_workflow(patient_data)
     
-    if results:
+    if "error" not in results:
         print("Dental care workflow completed successfully")
         print("Results:", results)
+
+        if results["patient_care_handle"]:
+            care_status = await dental_team.gather_results(results["patient_care_handle"])
+            print("Patient care status:", care_status)
     else:
-        print("Dental care workflow encountered an error")
+        print("Dental care workflow encountered an error; resume with workflow_id", results["workflow_id"])
 
 if __name__ == "__main__":
     asyncio.run(main())
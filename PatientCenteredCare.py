@@ -1,5 +1,22 @@
 from crewai import Agent, Task, Crew, Process
 from textwrap import dedent
+import asyncio
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+def _log_step(step_output):
+    """Log an agent step through logging instead of crewai's verbose printing"""
+    # Checked on every call, so enabling debug logging after import works,
+    # and step output is never formatted when it wouldn't be logged
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Agent step: %s", step_output)
+
+def _log_task(task_output):
+    """Log a completed task through logging instead of crewai's verbose printing"""
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Task completed: %s", task_output)
 
 # Define patient-centered research agents
 patient_advocate = Agent(
@@ -9,7 +26,7 @@ patient_advocate = Agent(
     oncology care. You ensure that research practices prioritize patient dignity, 
     comfort, and individual needs while maintaining clear communication with patients 
     and their families.""",
-    verbose=True,
+    verbose=False,
     allow_delegation=True
 )
 
@@ -20,7 +37,7 @@ care_coordinator = Agent(
     creating comprehensive support systems for cancer patients. You ensure each 
     patient receives personalized attention and has access to all necessary 
     resources.""",
-    verbose=True,
+    verbose=False,
     allow_delegation=True
 )
 
@@ -31,7 +48,7 @@ oncologist = Agent(
     person, not just the disease. You focus on developing personalized treatment 
     approaches while ensuring patients fully understand and consent to any research 
     participation.""",
-    verbose=True,
+    verbose=False,
     allow_delegation=True
 )
 
@@ -41,56 +58,80 @@ research_ethicist = Agent(
     backstory="""You are an ethics specialist focused on maintaining the highest 
     standards of patient dignity and autonomy in cancer research. You ensure all 
     research activities prioritize patient wellbeing.""",
-    verbose=True,
+    verbose=False,
     allow_delegation=True
 )
 
-# Define patient-centered tasks
+# Define patient-centered tasks. Support and treatment planning don't depend
+# on each other, so their LLM calls run concurrently; care coordination
+# integrates both, and the ethics review reviews all three. Each description
+# takes the patient's preferences through the {patient_preferences} input.
 patient_support_task = Task(
     description="""Create and implement comprehensive support plans for each patient, 
-    including emotional support, educational resources, and family assistance""",
-    agent=patient_advocate
-)
-
-care_coordination_task = Task(
-    description="""Develop and manage personalized care plans that integrate 
-    treatment, support services, and research participation in a way that 
-    prioritizes patient comfort and preferences""",
-    agent=care_coordinator
+    including emotional support, educational resources, and family assistance.
+    Patient preferences: {patient_preferences}""",
+    agent=patient_advocate,
+    async_execution=True
 )
 
 treatment_planning_task = Task(
     description="""Design and implement personalized treatment approaches that 
     respect patient choices and incorporate research opportunities only when 
-    appropriate and beneficial to the patient""",
-    agent=oncologist
+    appropriate and beneficial to the patient.
+    Patient preferences: {patient_preferences}""",
+    agent=oncologist,
+    async_execution=True
+)
+
+care_coordination_task = Task(
+    description="""Develop and manage personalized care plans that integrate 
+    treatment, support services, and research participation in a way that 
+    prioritizes patient comfort and preferences.
+    Patient preferences: {patient_preferences}""",
+    agent=care_coordinator,
+    context=[patient_support_task, treatment_planning_task]
 )
 
 ethics_review_task = Task(
     description="""Review all research protocols and practices to ensure they 
     maintain patient dignity, autonomy, and wellbeing while advancing medical 
-    knowledge""",
-    agent=research_ethicist
+    knowledge.
+    Patient preferences: {patient_preferences}""",
+    agent=research_ethicist,
+    context=[patient_support_task, treatment_planning_task, care_coordination_task]
 )
 
 # Create the patient-centered research crew
 patient_centered_crew = Crew(
     agents=[patient_advocate, care_coordinator, oncologist, research_ethicist],
-    tasks=[patient_support_task, care_coordination_task, treatment_planning_task, ethics_review_task],
+    tasks=[patient_support_task, treatment_planning_task, care_coordination_task, ethics_review_task],
     process=Process.sequential,
-    verbose=2
+    verbose=False,
+    step_callback=_log_step,
+    task_callback=_log_task
 )
 
 class PatientCenteredCare:
+    __slots__ = ("crew",)
+
     def __init__(self):
         self.crew = patient_centered_crew
+
+    async def run_crew(self, patient_preferences):
+        """Run the crew for one patient without blocking the caller's event loop"""
+        # Kickoff writes interpolated descriptions and outputs onto the crew
+        # and its tasks, so each call runs its own copy of the shared crew
+        crew = self.crew.copy()
+        preferences = "; ".join(f"{key}: {value}" for key, value in patient_preferences.items())
+        return await crew.kickoff_async(inputs={"patient_preferences": preferences})
         
-    def create_care_plan(self, patient_preferences):
+    async def create_care_plan(self, patient_preferences):
         """Create a personalized care plan based on patient preferences"""
         return {
             "treatment_plan": self._design_treatment_plan(patient_preferences),
             "support_services": self._arrange_support_services(patient_preferences),
-            "research_participation": self._evaluate_research_options(patient_preferences)
+            "research_participation": self._evaluate_research_options(patient_preferences),
+            "crew_recommendations": await self.run_crew(patient_preferences)
         }
     
     def _design_treatment_plan(self, preferences):
@@ -125,6 +166,62 @@ class PatientCenteredCare:
             "communication_plan": self._create_communication_plan()
         }
     
+    def _identify_alternatives(self, preferences):
+        """List alternatives to the preferred treatment approach"""
+        return {
+            "requested_alternatives": preferences.get("alternative_approaches", []),
+            "review": "Discussed with the oncologist before treatment starts"
+        }
+    
+    def _setup_counseling(self, preferences):
+        """Set up emotional support and counseling"""
+        return {
+            "individual_counseling": "Weekly",
+            "support_groups": "Optional",
+            "crisis_line": "Always available"
+        }
+    
+    def _arrange_family_services(self, preferences):
+        """Arrange support for the patient's family and caregivers"""
+        return {
+            "family_meetings": "Monthly",
+            "caregiver_support": "Available on request"
+        }
+    
+    def _organize_practical_help(self, preferences):
+        """Organize practical help around treatment"""
+        return {
+            "transportation": "Available on request",
+            "scheduling": preferences.get("scheduling_needs"),
+            "home_care": "Home care" in preferences.get("comfort_priorities", [])
+        }
+    
+    def _provide_education(self, preferences):
+        """Provide educational resources about the treatment"""
+        return {
+            "treatment_information": "Provided before each treatment phase",
+            "formats": ["Printed", "Online", "In person"]
+        }
+    
+    def _find_matching_studies(self, preferences):
+        """Describe how matching studies are found for the patient"""
+        return {
+            "matched_on": preferences.get("preferred_treatment_approach"),
+            "screening": "Research team and ethics review before any referral"
+        }
+    
+    def _identify_direct_benefits(self):
+        """List benefits research participation offers the patient directly"""
+        return ["Access to new treatment options", "Closer monitoring"]
+    
+    def _create_communication_plan(self):
+        """Plan how research participants are kept informed"""
+        return {
+            "progress_updates": "Monthly",
+            "contact": "Care coordinator",
+            "results_sharing": "Offered at study completion"
+        }
+    
     def get_patient_feedback(self):
         """Collect and process patient feedback to improve care"""
         feedback_system = {
@@ -145,13 +242,18 @@ class PatientCenteredCare:
         }
         return adjustments
 
+@functools.lru_cache(maxsize=1)
+def get_care_system():
+    """Return the shared care system, building it on first use"""
+    return PatientCenteredCare()
+
 def run_patient_centered_care():
     """Initialize and run the patient-centered care system"""
     try:
-        care_system = PatientCenteredCare()
+        care_system = get_care_system()
         return care_system
     except Exception as e:
-        print(f"Error initializing care system: {str(e)}")
+        logger.error("Error initializing care system: %s", e)
         return None
 
 if __name__ == "__main__":
@@ -166,5 +268,5 @@ if __name__ == "__main__":
         }
         
         # Create and implement care plan
-        care_plan = care_system.create_care_plan(patient_preferences)
+        care_plan = asyncio.run(care_system.create_care_plan(patient_preferences))
         print("Patient-Centered Care Plan Created")